@@ -1,3 +1,63 @@
-from django.test import TestCase
+import pandas as pd
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from .views import calculate_total_cost, state_from_plus_code, unique_search_locations
+
+
+class StateFromPlusCodeTests(SimpleTestCase):
+    def test_us_code_with_locality(self):
+        place = {'plus_code': {'compound_code': 'CWC8+R9 Mountain View, CA, USA'}}
+        self.assertEqual(state_from_plus_code(place), 'CA')
+
+    def test_us_code_without_locality(self):
+        place = {'plus_code': {'compound_code': 'CWC8+R9 CA, USA'}}
+        self.assertEqual(state_from_plus_code(place), 'CA')
+
+    def test_non_us_code(self):
+        place = {'plus_code': {'compound_code': 'GRX4+2C Toronto, ON, Canada'}}
+        self.assertIsNone(state_from_plus_code(place))
+
+    def test_missing_plus_code(self):
+        self.assertIsNone(state_from_plus_code({}))
+
+    def test_missing_compound_code(self):
+        place = {'plus_code': {'global_code': '849VCWC8+R9'}}
+        self.assertIsNone(state_from_plus_code(place))
+
+
+class UniqueSearchLocationsTests(SimpleTestCase):
+    def test_keeps_first_location_per_grid_cell(self):
+        locations = [
+            {'lat': 35.001, 'lng': -97.001},
+            {'lat': 35.002, 'lng': -97.002},  # Same cell as the first
+            {'lat': 35.5, 'lng': -97.5},
+            {'lat': 35.001, 'lng': -97.001},  # Revisits the first cell
+        ]
+        self.assertEqual(unique_search_locations(locations), [locations[0], locations[2]])
+
+    def test_empty_route(self):
+        self.assertEqual(unique_search_locations([]), [])
+
+
+class CalculateTotalCostTests(SimpleTestCase):
+    def test_matches_stations_despite_float_noise(self):
+        filtered_fuel_stations = pd.DataFrame([
+            {'OPIS Truckstop ID': 1, 'Truckstop Name': 'A', 'Retail Price': 3.0,
+             'state': 'OK', 'lat': 36.1 + 0.2, 'lng': -95.5},
+            {'OPIS Truckstop ID': 2, 'Truckstop Name': 'B', 'Retail Price': 3.5,
+             'state': 'TX', 'lat': 32.0, 'lng': -97.0},
+        ])
+        fuel_stations_within_500_miles = [
+            {'state': 'OK', 'lat': 36.3, 'lng': -95.5, 'distance': 100.0},
+            {'state': 'OK', 'lat': 36.3, 'lng': -95.5, 'distance': 999.0},  # Duplicate, ignored
+        ]
+
+        result = calculate_total_cost(filtered_fuel_stations, fuel_stations_within_500_miles)
+
+        self.assertEqual(result, [{'OPIS Truckstop ID': 1, 'Truckstop Name': 'A', 'total_cost': 30.0}])
+
+    def test_no_stations_within_range(self):
+        filtered_fuel_stations = pd.DataFrame(
+            columns=['OPIS Truckstop ID', 'Truckstop Name', 'Retail Price', 'state', 'lat', 'lng']
+        )
+        self.assertEqual(calculate_total_cost(filtered_fuel_stations, []), [])
@@ -1,54 +1,294 @@
 
 import googlemaps
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import lru_cache
+from urllib.parse import urlencode
+import numpy as np
+import orjson
 import pandas as pd
-from geopy.distance import geodesic
-from django.http import JsonResponse
+import pyproj
+import tempfile
+from django.http import HttpResponse, JsonResponse
 from rest_framework.decorators import api_view
 import os
 from django.conf import settings
-from shapely.geometry import LineString, Point
-import time
+from django.core.cache import cache
 
 # Constants
 VEHICLE_RANGE = 500  # in miles
 VEHICLE_MPG = 10  # miles per gallon
+MILES_PER_METER = 0.000621371
+MAX_CONCURRENT_REQUESTS = 10  # parallel Google Maps API calls per request
+SEARCH_RADIUS = 5000  # in meters, radius of each nearby gas station search
+SEARCH_GRID_SIZE = 0.05  # in degrees (~5km), one nearby search per grid cell
+DIRECTIONS_CACHE_TIMEOUT = 60 * 60 * 24  # in seconds
 API_KEY = settings.GOOGLE_MAPS_API_KEY
 FUEL_DATA_FILE = os.path.join('route_optimizer', 'data', 'fuel-prices-for-be-assessment.csv')
+FUEL_DATA_CACHE_VERSION = 3  # bump whenever the CSV transform in fuel_data() changes
+FUEL_DATA_CACHE_FILE = os.path.join(
+    'route_optimizer', 'data', f'fuel-prices-for-be-assessment-v{FUEL_DATA_CACHE_VERSION}.parquet'
+)
 GEOCODED_DATA_FILE = "geocoded_fuel_data.csv"
 
-# Load fuel price data
-FUEL_DATA = pd.read_csv(FUEL_DATA_FILE)
+# WGS84 ellipsoid for geodesic distances
+GEOD = pyproj.Geod(ellps='WGS84')
 
-# Initialize Google Maps client
-gmaps = googlemaps.Client(key=API_KEY)
+
+@lru_cache(maxsize=1)
+def fuel_data():
+    """
+    Load the fuel price data on first use, preferring the Parquet cache over the CSV.
+
+    The cache is (re)written from the CSV whenever it is missing or older than
+    the CSV, so edits to the source data are picked up on the next start.
+    The returned DataFrame is shared between requests and must not be mutated.
+
+    Returns:
+        pd.DataFrame: Fuel station data with typed columns.
+    """
+    if (os.path.exists(FUEL_DATA_CACHE_FILE)
+            and os.path.getmtime(FUEL_DATA_CACHE_FILE) >= os.path.getmtime(FUEL_DATA_FILE)):
+        return pd.read_parquet(FUEL_DATA_CACHE_FILE, engine='pyarrow')
+
+    data = pd.read_csv(
+        FUEL_DATA_FILE,
+        dtype={'Retail Price': 'float64', 'State': 'category', 'City': 'category'}
+    )
+    # Rows without a state or price can never be recommended, drop them once here
+    data = data.dropna(subset=['State', 'Retail Price']).reset_index(drop=True)
+    write_fuel_data_cache(data)
+    return data
+
+
+def write_fuel_data_cache(data):
+    """
+    Write the Parquet cache atomically; failures are ignored since the cache is optional.
+
+    The file is written under a temporary name in the same directory and then
+    renamed into place, so concurrent workers never read a half-written cache.
+
+    Args:
+        data (pd.DataFrame): Fuel station data to cache.
+    """
+    tmp_file = None
+    try:
+        fd, tmp_file = tempfile.mkstemp(
+            dir=os.path.dirname(FUEL_DATA_CACHE_FILE), suffix='.parquet.tmp'
+        )
+        os.close(fd)
+        data.to_parquet(tmp_file, engine='pyarrow', index=False)
+        os.replace(tmp_file, FUEL_DATA_CACHE_FILE)
+    except OSError:
+        if tmp_file and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+@lru_cache(maxsize=1)
+def gmaps_client():
+    """
+    Create the Google Maps client on first use.
+
+    Returns:
+        googlemaps.Client: Client shared by all requests.
+    """
+    return googlemaps.Client(key=API_KEY)
+
+
+@lru_cache(maxsize=1)
+def cheapest_stations_by_state():
+    """
+    Precompute the 5 cheapest fuel stations of every state.
+
+    Returns:
+        dict: State short name mapped to a DataFrame of its 5 cheapest stations.
+    """
+    return {
+        state: group.nsmallest(5, 'Retail Price')
+        for state, group in fuel_data().groupby('State', observed=True)
+    }
 
 
 def get_fuel_stations_by_state(fuel_stations_within_500_miles):
     """
-    Filters fuel stations based on unique states from `fuel_stations_within_500_miles`
-    and retrieves attributes from the CSV file, sorted by the least retail price.
+    Finds the 5 cheapest fuel stations across the unique states of
+    `fuel_stations_within_500_miles`, using the precomputed per-state
+    cheapest-station tables.
 
     Args:
         fuel_stations_within_500_miles (list): List of fuel station dictionaries with a 'state' key.
-        fuel_data_file (str): Path to the CSV file containing fuel station data.
 
     Returns:
-        pd.DataFrame: Filtered and sorted DataFrame with specific columns.
+        pd.DataFrame: Up to 5 stations sorted by retail price, with 'OPIS Truckstop ID',
+            'Truckstop Name' and 'Retail Price' columns.
     """
     
     
     # Extract unique states from `fuel_stations_within_500_miles`
     unique_states = {station['state'] for station in fuel_stations_within_500_miles}
     
-    # Filter the DataFrame based on the unique states
-    filtered_data = FUEL_DATA[FUEL_DATA['State'].isin(unique_states)]
-    sorted_data = filtered_data.sort_values(by='Retail Price')
-    # Select required columns and sort by retail price
+    # Combine the precomputed cheapest stations of each state
+    cheapest_by_state = cheapest_stations_by_state()
+    candidates = [cheapest_by_state[state] for state in unique_states if state in cheapest_by_state]
+    if not candidates:
+        return fuel_data()[['OPIS Truckstop ID', 'Truckstop Name', 'Retail Price']].head(0)
+
+    # Keep the 5 cheapest overall, sorted by retail price
+    sorted_data = pd.concat(candidates).nsmallest(5, 'Retail Price')
+    # Select required columns
     result = sorted_data[['OPIS Truckstop ID', 'Truckstop Name', 'Retail Price']]
     
-    return result.head(5)
+    return result
+
+
+
+def geodesic_miles(lat, lng, lats, lngs):
+    """
+    Geodesic (WGS84) distance in miles from a single point to arrays of points.
+
+    Args:
+        lat (float): Latitude of the origin point.
+        lng (float): Longitude of the origin point.
+        lats (np.ndarray): Latitudes of the destination points.
+        lngs (np.ndarray): Longitudes of the destination points.
+
+    Returns:
+        np.ndarray: Distances in miles, one per destination point.
+    """
+    lats, lngs = np.asarray(lats, dtype=float), np.asarray(lngs, dtype=float)
+    if lats.size == 0:
+        return np.empty(0)
+
+    _, _, meters = GEOD.inv(np.full_like(lngs, lng), np.full_like(lats, lat), lngs, lats)
+    return np.asarray(meters) * MILES_PER_METER
+
+
+def get_directions(start_address, finish_address):
+    """
+    Fetch driving directions between two addresses, cached per address pair.
+
+    Args:
+        start_address (str): Route origin.
+        finish_address (str): Route destination.
 
+    Returns:
+        list: Directions API result, empty if no route was found.
+    """
+    key = 'dir:' + hashlib.sha1(f'{start_address}|{finish_address}'.encode()).hexdigest()
+    directions_result = cache.get(key)
+    if directions_result is None:
+        directions_result = gmaps_client().directions(
+            origin=start_address,
+            destination=finish_address,
+            mode="driving",
+            departure_time=datetime.now()
+        )
+        # Only cache successful lookups so a transient failure is retried
+        if directions_result:
+            cache.set(key, directions_result, DIRECTIONS_CACHE_TIMEOUT)
+    return directions_result
+
+
+def unique_search_locations(locations):
+    """
+    Drop locations that fall in the same search grid cell as an earlier one.
+
+    Consecutive route steps often end within a few kilometres of each other, so
+    their nearby searches would return mostly the same stations. This trades
+    some recall for fewer API calls: a dropped location can be up to a cell
+    diagonal (~7km) from the kept one, more than SEARCH_RADIUS, so stations
+    near a dropped location may not be found.
+
+    Args:
+        locations (list): Locations with 'lat' and 'lng' keys.
+
+    Returns:
+        list: The first location seen in each grid cell, in route order.
+    """
+    seen = set()
+    unique_locations = []
+    for location in locations:
+        key = (round(location['lat'] / SEARCH_GRID_SIZE), round(location['lng'] / SEARCH_GRID_SIZE))
+        if key in seen:
+            continue
+        seen.add(key)
+        unique_locations.append(location)
+    return unique_locations
+
+
+def find_nearby_gas_stations(location):
+    """
+    Search for gas stations near a route location.
+
+    Args:
+        location (dict): Location with 'lat' and 'lng' keys.
+
+    Returns:
+        list: Places API results for the gas stations found.
+    """
+    places_result = gmaps_client().places_nearby(
+        location=(location['lat'], location['lng']),
+        radius=SEARCH_RADIUS,
+        type='gas_station'
+    )
+    return places_result.get('results', [])
+
+
+def state_from_plus_code(place):
+    """
+    Extract the state short name from the plus code of a Places API result.
+
+    US compound codes look like 'CWC8+R9 Mountain View, CA, USA', so the state
+    is the last word before the country. The locality in a compound code is a
+    nearby reference town, not the result of a point-in-state lookup, so a
+    station close to a state line (e.g. around Texarkana) can be attributed to
+    the neighbouring state. This is accepted in exchange for skipping one
+    reverse geocode call per station.
+
+    Args:
+        place (dict): Places API result.
+
+    Returns:
+        str: State short name (e.g. 'TX'), or None if the code does not name one.
+    """
+    compound_code = place.get('plus_code', {}).get('compound_code', '')
+    parts = [part.strip() for part in compound_code.split(',')]
+    if len(parts) < 2 or parts[-1] != 'USA' or not parts[-2]:
+        return None
+
+    state = parts[-2].split()[-1]
+    if len(state) == 2 and state.isalpha() and state.isupper():
+        return state
+    return None
+
+
+def get_state(place):
+    """
+    Resolve the short name of the state a place is in.
+
+    The plus code already returned by the Places API is used when possible;
+    reverse geocoding is only a fallback, since it costs one API call per place.
+
+    Args:
+        place (dict): Places API result with a 'geometry' key.
+
+    Returns:
+        str: State short name (e.g. 'TX'), or None if it could not be resolved.
+    """
+    state = state_from_plus_code(place)
+    if state:
+        return state
+
+    location = place['geometry']['location']
+    reverse_geocode_result = gmaps_client().reverse_geocode((location['lat'], location['lng']))
+
+    # Extract the short name of the state from the address components
+    if reverse_geocode_result:
+        for component in reverse_geocode_result[0]['address_components']:
+            if 'administrative_area_level_1' in component['types']:
+                return component.get('short_name', None)  # Use the short_name instead of long_name
+    return None
 
 
 def calculate_fuel_cost(distance, fuel_price):
@@ -62,40 +302,32 @@ def calculate_total_cost(filtered_fuel_stations, fuel_stations_within_500_miles)
     """
     Calculate the total cost for the first 5 stations based on their distance and retail price.
 
+    Stations are matched on state and on coordinates rounded to 6 decimals
+    (~0.1m), so tiny float differences between the two sources still match.
+
     Args:
-        filtered_fuel_stations (pd.DataFrame): DataFrame containing fuel stations sorted by retail price.
+        filtered_fuel_stations (pd.DataFrame): DataFrame containing fuel stations sorted by retail price,
+            with 'state', 'lat' and 'lng' columns in addition to the output columns.
         fuel_stations_within_500_miles (list): List of fuel stations with distance information.
 
     Returns:
         list: List of dictionaries with 'OPIS Truckstop ID', 'Truckstop Name', and 'total_cost'.
     """
-    result = []
     # Convert fuel_stations_within_500_miles to a DataFrame for easier querying
-    station_distances = pd.DataFrame(fuel_stations_within_500_miles)
-
-    # Iterate over the first 5 rows in the filtered_fuel_stations
-    for _, row in filtered_fuel_stations.head(5).iterrows():
-        opis_id = row['OPIS Truckstop ID']
-        name = row['Truckstop Name']
-        price = row['Retail Price']
-
-        # Find the matching station in the station_distances list
-        matching_station = station_distances[
-            (station_distances['state'] == row['state']) &
-            (station_distances['lat'] == row['lat']) &
-            (station_distances['lng'] == row['lng'])
-        ]
-
-        if not matching_station.empty:
-            distance = matching_station.iloc[0]['distance']  # Extract the distance
-            total_cost = calculate_fuel_cost(distance, price)  # Calculate total cost
+    station_distances = pd.DataFrame(
+        fuel_stations_within_500_miles, columns=['state', 'lat', 'lng', 'distance']
+    ).round({'lat': 6, 'lng': 6}).drop_duplicates(subset=['state', 'lat', 'lng'])  # First match wins
 
-            result.append({
-                'OPIS Truckstop ID': opis_id,
-                'Truckstop Name': name,
-                'total_cost': round(total_cost, 2)
-            })
+    # Match the first 5 stations to their distances in a single join
+    merged = pd.merge(
+        filtered_fuel_stations.head(5).round({'lat': 6, 'lng': 6}),
+        station_distances,
+        on=['state', 'lat', 'lng'],
+        how='inner'
+    )
+    merged['total_cost'] = calculate_fuel_cost(merged['distance'], merged['Retail Price']).round(2)
 
+    result = merged[['OPIS Truckstop ID', 'Truckstop Name', 'total_cost']].to_dict('records')
     return result
 
 
@@ -110,67 +342,66 @@ def optimize_route(request):
         return JsonResponse({"error": "Start and finish locations are required."}, status=400)
 
     # Get route data
-    directions_result = gmaps.directions(
-        origin=start_address,
-        destination=finish_address,
-        mode="driving",
-        departure_time=datetime.now()
-    )
+    directions_result = get_directions(start_address, finish_address)
 
     if not directions_result:
         return JsonResponse({"error": "Failed to fetch route."}, status=400)
 
     # Extract route and start coordinates
-    route = directions_result[0]['legs'][0]['steps']
-    start_coords = directions_result[0]['legs'][0]['start_location']
+    leg = directions_result[0]['legs'][0]
+    route = leg['steps']
+    start_coords = leg['start_location']
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        # Search for fuel stations near the end of every step concurrently
+        step_locations = unique_search_locations([step['end_location'] for step in route])
+
+        # Skip searches that cannot return a station within range of the start
+        step_distances = geodesic_miles(
+            start_coords['lat'], start_coords['lng'],
+            [location['lat'] for location in step_locations],
+            [location['lng'] for location in step_locations]
+        )
+        max_search_distance = VEHICLE_RANGE + SEARCH_RADIUS * MILES_PER_METER
+        step_locations = [
+            location
+            for location, distance in zip(step_locations, step_distances)
+            if distance <= max_search_distance
+        ]
 
-    # Function to check if the distance from the start location is within 500 miles
-    def is_within_500_miles(coord, start_coords):
-        return geodesic((start_coords['lat'], start_coords['lng']), coord).miles <= 500
+        # Keep each station once, even if several searches returned it
+        places_by_id = {}
+        for results in executor.map(find_nearby_gas_stations, step_locations):
+            for place in results:
+                places_by_id.setdefault(place['place_id'], place)
+        places = list(places_by_id.values())
+
+        # Distance from the start location to every station, computed in one vectorized pass
+        lats = np.array([place['geometry']['location']['lat'] for place in places], dtype=float)
+        lngs = np.array([place['geometry']['location']['lng'] for place in places], dtype=float)
+        distances = geodesic_miles(start_coords['lat'], start_coords['lng'], lats, lngs)
+
+        # Keep stations within the vehicle range from the start
+        in_range = distances <= VEHICLE_RANGE
+        places = [place for place, keep in zip(places, in_range) if keep]
+        distances = distances[in_range]
+
+        # Resolve the state of the remaining stations, reverse geocoding concurrently where needed
+        states = list(executor.map(get_state, places))
 
     # List to hold fuel stations within 500 miles
     fuel_stations_within_500_miles = []
 
-    # Iterate over the steps (each step represents a part of the journey)
-    for step in route:
-        location = step['end_location']
-        
-        # Search for fuel stations near this location
-        places_result = gmaps.places_nearby(
-            location=(location['lat'], location['lng']),
-            radius=5000,  # Search within a 5km radius (adjustable)
-            type='gas_station'
-        )
-        
-        # Extract relevant fuel station info
-        if places_result.get('results'):
-            for place in places_result['results']:
-                # Check if the location is within 500 miles from the start
-                if is_within_500_miles((place['geometry']['location']['lat'], place['geometry']['location']['lng']), start_coords):
-                    # Reverse geocode to get detailed address components
-                    reverse_geocode_result = gmaps.reverse_geocode((place['geometry']['location']['lat'], place['geometry']['location']['lng']))
-                    state = None
-                    
-                    # Extract the short name of the state from the address components
-                    if reverse_geocode_result:
-                        for component in reverse_geocode_result[0]['address_components']:
-                            if 'administrative_area_level_1' in component['types']:
-                                state = component.get('short_name', None)  # Use the short_name instead of long_name
-                                break
-                    
-                    # Calculate the distance from the start location to the fuel station
-                    fuel_station_coords = (place['geometry']['location']['lat'], place['geometry']['location']['lng'])
-                    distance = geodesic((start_coords['lat'], start_coords['lng']), fuel_station_coords).miles
-                    
-                    # Add the fuel station information, including state and distance
-                    fuel_station_info = {
-                        'lat': place['geometry']['location']['lat'],
-                        'lng': place['geometry']['location']['lng'],
-                        'formatted_address': place['vicinity'],
-                        'state': state,  # State as short name
-                        'distance': distance  # Distance to the fuel station
-                    }
-                    fuel_stations_within_500_miles.append(fuel_station_info)
+    for place, state, distance in zip(places, states, distances):
+        # Add the fuel station information, including state and distance
+        fuel_station_info = {
+            'lat': place['geometry']['location']['lat'],
+            'lng': place['geometry']['location']['lng'],
+            'formatted_address': place['vicinity'],
+            'state': state,  # State as short name
+            'distance': float(distance)  # Distance to the fuel station
+        }
+        fuel_stations_within_500_miles.append(fuel_station_info)
     filtered_fuel_stations = get_fuel_stations_by_state(fuel_stations_within_500_miles)
     #top_stations_with_costs = calculate_total_cost(filtered_fuel_stations, fuel_stations_within_500_miles)
     # Convert the DataFrame to JSON
@@ -181,13 +412,21 @@ def optimize_route(request):
     
     # Response with the map and fuel stations within 500 miles
     response_data = {
-        "route_map": f"https://www.google.com/maps/dir/?api=1&origin={start_address}&destination={finish_address}",
+        "route_map": "https://www.google.com/maps/dir/?" + urlencode({
+            'api': 1,
+            'origin': start_address,
+            'destination': finish_address
+        }),
         
         "optimal_stations":filtered_fuel_stations_json,
-        "direction": directions_result
+        "direction": {
+            "overview": directions_result[0]['overview_polyline'],
+            "distance": leg['distance'],
+            "duration": leg['duration']
+        }
     }
     
-    return JsonResponse(response_data)
+    return HttpResponse(orjson.dumps(response_data), content_type='application/json')
 
     
     
\ No newline at end of file